@@ -1,112 +1,447 @@
+import asyncio
 import requests
 import json
+import os
+import re
+import shelve
 import time
-from typing import Dict, List, Union
+from typing import Callable, Dict, List, Optional, Union
+from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
+from requests.adapters import HTTPAdapter
 
-def add_coordinates_nominatim(location_data: Union[Dict, List[Dict]], delay: float = 1.0) -> Union[Dict, List[Dict]]:
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+
+# Important: Use a proper User-Agent to avoid being blocked
+NOMINATIM_HEADERS = {
+    'User-Agent': 'PokemonVendingMachineLocator/1.0 (your-email@example.com)'
+}
+
+MAX_RETRIES = 3
+RETRY_DELAY = 2
+RETRY_STATUSES = (429, 502, 503, 504)
+
+GEOCODE_CACHE_FILE = '.geocode_cache'
+FAILURES_FILE = '.geocode_failures.json'
+FAILURE_TTL = 30 * 24 * 60 * 60  # Retry addresses with no results after 30 days
+
+class _TokenBucket:
+    """
+    Async rate limiter that hands out one token every `interval` seconds, or later
+    when Retry-After says so
+    """
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._tokens = asyncio.Queue(maxsize=1)
+        self._task = None
+        self._hold_until = 0.0
+
+    async def _refill(self):
+        while True:
+            await self._tokens.put(None)
+            # Wait until the token is taken before starting the next interval
+            await self._tokens.join()
+            await asyncio.sleep(self._interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._refill())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def acquire(self):
+        await self._tokens.get()
+        # A backoff requested after this token was issued still applies to it
+        await asyncio.sleep(max(0.0, self._hold_until - time.monotonic()))
+        self._tokens.task_done()
+
+    def backoff(self, headers, default: float):
+        """Hold back the next token by Retry-After, or by `default` if the server sent none"""
+        retry_after = _retry_after(headers)
+        wait = retry_after if retry_after is not None else default
+        self._hold_until = max(self._hold_until, time.monotonic() + wait)
+
+def _retry_after(headers) -> Optional[float]:
+    """Seconds the server asked us to wait via Retry-After, if it sent a numeric value"""
+    value = headers.get('Retry-After') if headers is not None else None
+    if value and value.strip().isdigit():
+        return float(value)
+    return None
+
+class _Pacer:
+    """
+    Blocking rate limiter that waits only as long as the server requires: at least
+    `interval` seconds between request starts, or longer when Retry-After says so
+    """
+    def __init__(self, interval: float):
+        self._interval = interval
+        self.next_allowed_ts = 0.0
+
+    def wait(self):
+        time.sleep(max(0.0, self.next_allowed_ts - time.monotonic()))
+        self.next_allowed_ts = time.monotonic() + self._interval
+
+    def backoff(self, headers, default: float):
+        """Push the next request out by Retry-After, or by `default` if the server sent none"""
+        retry_after = _retry_after(headers)
+        wait = retry_after if retry_after is not None else default
+        self.next_allowed_ts = max(self.next_allowed_ts, time.monotonic() + wait)
+
+def _json_loads(content: Union[str, bytes]):
+    """Parse JSON with orjson when available, falling back to the standard library"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _json_dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+def _apply_geocode_result(location_json: Dict, data: List[Dict], failures: Dict[str, float]) -> Dict:
+    """Copy the first Nominatim result (if any) into the location's lat/lng"""
+    if data and len(data) > 0:
+        # Successfully found coordinates
+        location_json['lat'] = float(data[0]['lat'])
+        location_json['lng'] = float(data[0]['lon'])
+    else:
+        # Nominatim has nothing for this address, so don't ask again until the TTL expires
+        failures[_normalize_address(location_json['address'])] = time.time()
+        location_json['lat'] = None
+        location_json['lng'] = None
+    return location_json
+
+def _normalize_address(address: str) -> str:
+    return re.sub(r'\s+', ' ', address.strip().lower())
+
+def _has_coordinates(location_json: Dict) -> bool:
+    return location_json.get('lat') is not None
+
+def _from_cache(cache: shelve.Shelf, location_json: Dict) -> bool:
+    """Fill in coordinates from the geocode cache, returning whether there was a hit"""
+    key = _normalize_address(location_json['address'])
+    if key in cache:
+        location_json.update(cache[key])
+        return True
+    return False
+
+def _pending_by_address(locations: List[Dict], cache: shelve.Shelf,
+                        failures: Dict[str, float]) -> Dict[str, List[Dict]]:
+    """Group the locations that still need a lookup by normalized address"""
+    unique = {}
+    for location in locations:
+        if _has_coordinates(location) or _from_cache(cache, location):
+            continue
+        key = _normalize_address(location['address'])
+        if key not in failures:
+            unique.setdefault(key, []).append(location)
+    return unique
+
+def _load_failures(filename: str, ttl: float) -> Dict[str, float]:
+    """Load addresses that previously returned no results, dropping entries older than `ttl`"""
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, 'rb') as f:
+            failures = _json_loads(f.read())
+    except ValueError:
+        # An unreadable file only costs us a retry of those addresses
+        return {}
+    cutoff = time.time() - ttl
+    return {address: failed_at for address, failed_at in failures.items() if failed_at >= cutoff}
+
+def _save_failures(failures: Dict[str, float], filename: str):
+    # Write to a temporary file first so an interrupted save can't leave truncated JSON
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        f.write(_json_dumps(failures))
+    os.replace(tmp_filename, filename)
+
+def _to_cache(cache: shelve.Shelf, location_json: Dict):
+    """Remember a successful geocode for future runs"""
+    if location_json['lat'] is not None:
+        cache[_normalize_address(location_json['address'])] = {
+            'lat': location_json['lat'],
+            'lng': location_json['lng']
+        }
+
+def _finish_group(group: List[Dict], cache: shelve.Shelf):
+    """Share the first location's result with its duplicates and cache it right away"""
+    first = group[0]
+    for other in group[1:]:
+        other['lat'] = first['lat']
+        other['lng'] = first['lng']
+    _to_cache(cache, first)
+
+# "street, city, ST" with an optional ZIP, as produced by scrape.py
+_ADDRESS_RE = re.compile(
+    r'^(?P<street>.+),\s*(?P<city>[^,]+),\s*(?P<state>[A-Z]{2})(?:\s+(?P<postalcode>\d{5}))?$'
+)
+
+def _nominatim_queries(location_json: Dict) -> List[Dict]:
+    """
+    Nominatim queries to try in order: a structured query when the address splits cleanly,
+    then the free-form address text
+    """
+    base = {
+        'format': 'jsonv2',
+        'limit': 1
+    }
+    queries = []
+    
+    match = _ADDRESS_RE.match(location_json['address'].strip())
+    if match:
+        structured = {field: value for field, value in match.groupdict().items() if value}
+        queries.append({**base, **structured, 'country': 'US'})
+    queries.append({**base, 'q': location_json['address']})
+    return queries
+
+async def _fetch_one(session, limiter: _TokenBucket, params: Dict, address: str) -> Optional[List[Dict]]:
+    """Run one Nominatim query with retries, returning None if every attempt failed"""
+    timeout = aiohttp.ClientTimeout(total=10)
+
+    for attempt in range(MAX_RETRIES):
+        # Every attempt, including retries, waits for a token
+        await limiter.acquire()
+        try:
+            async with session.get(NOMINATIM_URL, params=params, timeout=timeout) as response:
+                if response.status == 200:
+                    return await response.json(loads=_json_loads)
+
+                elif response.status in RETRY_STATUSES:
+                    # Rate limited or temporarily unavailable - hold back every coroutine's
+                    # next request as long as the server asks, or back off
+                    limiter.backoff(response.headers, RETRY_DELAY * (attempt + 1))
+                    continue
+
+                else:
+                    tqdm.write(f"HTTP Error {response.status} for: {address}")
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # ValueError covers a 200 response whose body isn't valid JSON
+            tqdm.write(f"Network error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+            if attempt < MAX_RETRIES - 1:
+                limiter.backoff(None, RETRY_DELAY)
+                continue
+
+    return None
+
+async def _geocode_one(session, sem: asyncio.Semaphore, limiter: _TokenBucket, location_json: Dict,
+                       failures: Dict[str, float]) -> Dict:
+    """Geocode a single location over a shared aiohttp session"""
+    async with sem:
+        for params in _nominatim_queries(location_json):
+            data = await _fetch_one(session, limiter, params, location_json['address'])
+            if data is None:
+                # If all retries failed
+                tqdm.write(f"✗ Failed to geocode: {location_json['address']}")
+                location_json['lat'] = None
+                location_json['lng'] = None
+                return location_json
+            if data:
+                break
+
+    # Only an empty answer to every query counts as "no results"
+    return _apply_geocode_result(location_json, data, failures)
+
+async def _run(groups: List[List[Dict]], delay: float, concurrency: int,
+               failures: Dict[str, float], finish: Callable[[List[Dict]], None]):
+    """
+    Geocode the first location of each group concurrently while keeping to one request
+    per `delay` seconds, calling `finish` on each group as soon as its lookup completes
+    """
+    if not groups:
+        return
+
+    limiter = _TokenBucket(delay)
+    limiter.start()
+    concurrency = max(1, concurrency)
+    sem = asyncio.Semaphore(concurrency)
+    # One connection per in-flight request, so a request starts as soon as it takes its
+    # token; with fewer, taken tokens would queue for a socket and then fire in a burst
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency, limit=64)
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, headers=NOMINATIM_HEADERS) as session:
+            async def geocode_group(group: List[Dict]):
+                await _geocode_one(session, sem, limiter, group[0], failures)
+                finish(group)
+
+            await tqdm_asyncio.gather(*[geocode_group(group) for group in groups], desc='Geocoding')
+    finally:
+        limiter.stop()
+
+def _build_session() -> requests.Session:
+    """Create a keep-alive session that reuses one pooled connection to Nominatim"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    session.headers.update(NOMINATIM_HEADERS)
+    return session
+
+def add_coordinates_nominatim(location_data: Union[Dict, List[Dict]], delay: float = 1.0,
+                              concurrency: int = 4,
+                              cache_file: str = GEOCODE_CACHE_FILE,
+                              failures_file: str = FAILURES_FILE,
+                              failure_ttl: float = FAILURE_TTL) -> Union[Dict, List[Dict]]:
     """
     Takes a JSON object or list of JSON objects with addresses, queries Nominatim OpenStreetMap API 
     to get coordinates, and returns the data with lat/lng added.
     
+    Lists are geocoded concurrently with aiohttp when it is installed, otherwise one at a time.
+    Addresses that were geocoded on a previous run are served from an on-disk cache, which
+    is written as each lookup completes so an interrupted run resumes where it stopped.
+    Addresses that returned no results are remembered and skipped until `failure_ttl` passes.
+    
     Args:
         location_data: Single JSON object or list of JSON objects with address field
-        delay: Delay between requests in seconds (default 1.0 to respect rate limits)
+        delay: Minimum time between requests in seconds (default 1.0 to respect rate limits)
+        concurrency: Maximum number of in-flight requests when using aiohttp
+        cache_file: Path of the persistent geocode cache
+        failures_file: Path of the file listing addresses that returned no results
+        failure_ttl: Seconds before an address with no results is tried again
     
     Returns:
         Updated JSON object(s) with coordinates filled in
     """
     
-    def geocode_single_location(location_json: Dict) -> Dict:
-        """Geocode a single location"""
-        base_url = "https://nominatim.openstreetmap.org/search"
-        
-        # Important: Use a proper User-Agent to avoid being blocked
-        headers = {
-            'User-Agent': 'PokemonVendingMachineLocator/1.0 (your-email@example.com)'
-        }
-        
-        params = {
-            'q': location_json['address'],
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1  # Get more detailed address info
-        }
-        
-        max_retries = 3
-        retry_delay = 2
-        
-        for attempt in range(max_retries):
+    def fetch(params: Dict, address: str, session: requests.Session, pacer: _Pacer) -> Optional[List[Dict]]:
+        """Run one Nominatim query with retries, returning None if every attempt failed"""
+        for attempt in range(MAX_RETRIES):
             try:
-                response = requests.get(base_url, headers=headers, params=params, timeout=10)
+                # Every attempt, including retries, keeps to the pacer's spacing
+                pacer.wait()
+                response = session.get(NOMINATIM_URL, params=params, timeout=10)
                 
                 if response.status_code == 200:
-                    data = response.json()
-                    if data and len(data) > 0:
-                        # Successfully found coordinates
-                        location_json['coordinates']['lat'] = float(data[0]['lat'])
-                        location_json['coordinates']['lng'] = float(data[0]['lon'])
-                        print(f"✓ Geocoded: {location_json['name']} - {location_json['address']}")
-                        return location_json
-                    else:
-                        print(f"⚠ No results found for: {location_json['address']}")
-                        location_json['coordinates']['lat'] = None
-                        location_json['coordinates']['lng'] = None
-                        return location_json
-                        
-                elif response.status_code == 429:
-                    # Rate limited - wait longer
-                    print(f"Rate limited, waiting {retry_delay * (attempt + 1)} seconds...")
-                    time.sleep(retry_delay * (attempt + 1))
+                    return _json_loads(response.content)
+                
+                elif response.status_code in RETRY_STATUSES:
+                    # Rate limited or temporarily unavailable - wait as long as the server asks, or back off
+                    pacer.backoff(response.headers, RETRY_DELAY * (attempt + 1))
                     continue
-                    
+                
                 else:
-                    print(f"HTTP Error {response.status_code} for: {location_json['address']}")
-                    
-            except requests.exceptions.RequestException as e:
-                print(f"Network error (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+                    tqdm.write(f"HTTP Error {response.status_code} for: {address}")
+                
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # ValueError covers a 200 response whose body isn't valid JSON
+                tqdm.write(f"Network error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                if attempt < MAX_RETRIES - 1:
+                    pacer.backoff(None, RETRY_DELAY)
                     continue
         
-        # If all retries failed
-        print(f"✗ Failed to geocode: {location_json['address']}")
-        location_json['coordinates']['lat'] = None
-        location_json['coordinates']['lng'] = None
-        return location_json
+        return None
     
-    # Handle single object or list of objects
-    if isinstance(location_data, dict):
-        return geocode_single_location(location_data.copy())
-    elif isinstance(location_data, list):
-        results = []
-        total = len(location_data)
-        
-        for i, location in enumerate(location_data, 1):
-            print(f"Processing {i}/{total}...")
-            result = geocode_single_location(location.copy())
-            results.append(result)
-            
-            # Rate limiting - wait between requests
-            if i < total:  # Don't wait after the last request
-                time.sleep(delay)
+    def geocode_single_location(location_json: Dict, session: requests.Session, pacer: _Pacer) -> Dict:
+        """Geocode a single location"""
+        for params in _nominatim_queries(location_json):
+            data = fetch(params, location_json['address'], session, pacer)
+            if data is None:
+                # If all retries failed
+                tqdm.write(f"✗ Failed to geocode: {location_json['address']}")
+                location_json['lat'] = None
+                location_json['lng'] = None
+                return location_json
+            if data:
+                break
         
-        return results
-    else:
+        # Only an empty answer to every query counts as "no results"
+        return _apply_geocode_result(location_json, data, failures)
+    
+    if not isinstance(location_data, (dict, list)):
         raise ValueError("Input must be a dictionary or list of dictionaries")
+    
+    pacer = _Pacer(delay)
+    
+    failures = _load_failures(failures_file, failure_ttl)
+    
+    with shelve.open(cache_file) as cache:
+        try:
+            # Handle single object or list of objects
+            if isinstance(location_data, dict):
+                result = location_data.copy()
+                if _pending_by_address([result], cache, failures):
+                    with _build_session() as session:
+                        result = geocode_single_location(result, session, pacer)
+                    _to_cache(cache, result)
+                return result
+            
+            results = [location.copy() for location in location_data]
+            unique = _pending_by_address(results, cache, failures)
+            
+            def finish(group: List[Dict]):
+                _finish_group(group, cache)
+            
+            # Only the first location per unique address is looked up
+            if aiohttp is not None:
+                asyncio.run(_run(list(unique.values()), delay, concurrency, failures, finish))
+            else:
+                with _build_session() as session:
+                    for group in tqdm(unique.values(), desc='Geocoding'):
+                        geocode_single_location(group[0], session, pacer)
+                        finish(group)
+            
+            return results
+        finally:
+            _save_failures(failures, failures_file)
+
+def _json_dumps_indented(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode()
 
 def save_results(data: Union[Dict, List[Dict]], filename: str = 'geocoded_locations.json'):
-    """Save results to a JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    """Save results to a JSON file, encoding list entries one at a time to bound memory use"""
+    with open(filename, 'wb') as f:
+        if isinstance(data, dict) or not data:
+            f.write(_json_dumps_indented(data))
+        else:
+            f.write(b'[\n')
+            for i, record in enumerate(data):
+                if i:
+                    f.write(b',\n')
+                # Nest each record one level in so the file matches a whole-list indent=2 dump
+                f.write(b'  ' + _json_dumps_indented(record).replace(b'\n', b'\n  '))
+            f.write(b'\n]')
     print(f"Results saved to {filename}")
 
 def load_from_file(filename: str) -> Union[Dict, List[Dict]]:
     """Load JSON data from file"""
-    with open(filename, 'r') as f:
-        return json.load(f)
+    with open(filename, 'rb') as f:
+        return _json_loads(f.read())
+
+def flatten_coordinates(location_json: Dict) -> Dict:
+    """Move a legacy nested 'coordinates' object to top-level lat/lng fields"""
+    coordinates = location_json.pop('coordinates', None)
+    if coordinates is not None:
+        location_json['lat'] = coordinates.get('lat')
+        location_json['lng'] = coordinates.get('lng')
+    return location_json
+
+def migrate_coordinates(filename: str):
+    """Rewrite a JSON file that still uses nested 'coordinates' in the flat lat/lng form"""
+    data = load_from_file(filename)
+    if isinstance(data, list):
+        data = [flatten_coordinates(location) for location in data]
+    else:
+        data = flatten_coordinates(data)
+    save_results(data, filename)
 
 # Example usage
 if __name__ == "__main__":
+    import pandas as pd
+    
     # Load Pokemon vending machine data
     input_filename = 'pokemon_vending_machines.json'
     output_filename = 'pokemon_vending_machines_with_coordinates.json'
@@ -126,8 +461,11 @@ if __name__ == "__main__":
         save_results(geocoded_locations, output_filename)
         
         # Print summary
-        successful_geocodes = sum(1 for loc in geocoded_locations if loc['coordinates']['lat'] is not None)
-        failed_geocodes = len(geocoded_locations) - successful_geocodes
+        df = pd.DataFrame.from_records(geocoded_locations,
+                                       columns=['name', 'machine_id', 'address', 'lat', 'lng'])
+        geocoded = df['lat'].notna()
+        successful_geocodes = int(geocoded.sum())
+        failed_geocodes = len(df) - successful_geocodes
         
         print(f"\nGeocoding Summary:")
         print(f"✓ Successfully geocoded: {successful_geocodes}")
@@ -137,23 +475,17 @@ if __name__ == "__main__":
         # Show some examples of successful geocodes
         if successful_geocodes > 0:
             print(f"\nFirst few successful geocodes:")
-            count = 0
-            for location in geocoded_locations:
-                if location['coordinates']['lat'] is not None and count < 5:
-                    lat = location['coordinates']['lat']
-                    lng = location['coordinates']['lng']
-                    print(f"✓ {location['name']} ({location['machine_id']}) - {location['address']}")
-                    print(f"  Coordinates: {lat}, {lng}")
-                    count += 1
+            for _, location in df[geocoded].head(5).iterrows():
+                lat = location['lat']
+                lng = location['lng']
+                print(f"✓ {location['name']} ({location['machine_id']}) - {location['address']}")
+                print(f"  Coordinates: {lat}, {lng}")
         
         # Show some examples of failed geocodes
         if failed_geocodes > 0:
             print(f"\nFirst few failed geocodes:")
-            count = 0
-            for location in geocoded_locations:
-                if location['coordinates']['lat'] is None and count < 5:
-                    print(f"✗ {location['name']} ({location['machine_id']}) - {location['address']}")
-                    count += 1
+            for _, location in df[~geocoded].head(5).iterrows():
+                print(f"✗ {location['name']} ({location['machine_id']}) - {location['address']}")
                     
     except FileNotFoundError:
         print(f"Error: Could not find {input_filename}")
@@ -1,106 +1,110 @@
 import requests
-from bs4 import BeautifulSoup
+import lxml.html
 import json
 import pandas as pd
 import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_loads(content):
+    """Parse JSON with orjson when available, falling back to the standard library"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _json_dumps_indented(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode()
 
 def scrape_pokemon_vending_machines(html_content):
     """
     Scrapes Pokemon vending machine data from raw HTML content
     """
+    # lxml rejects empty documents, but an empty page simply has no machines
+    if not html_content or not html_content.strip():
+        return []
+    
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
+        if isinstance(html_content, str):
+            # lxml refuses str input that starts with an XML encoding declaration, so
+            # hand it UTF-8 bytes and say so, whatever the declaration claims
+            doc = lxml.html.fromstring(html_content.encode('utf-8'),
+                                       parser=lxml.html.HTMLParser(encoding='utf-8'))
+        else:
+            doc = lxml.html.fromstring(html_content)
+
         # Find the table containing vending machine data
-        table = soup.find('table')
+        tables = doc.xpath('(//table)[1]')
         
-        if not table:
+        if not tables:
             # If no table found, look for pipe-separated data in the text
-            page_text = soup.get_text()
+            page_text = doc.text_content()
             return parse_pipe_separated_data(page_text)
         
-        json_output = []
-        
-        # Process table rows
-        rows = table.find_all('tr')[1:]  # Skip header row
+        # Process table rows, reading each cell's text once
+        rows = (
+            [col.text_content().strip() for col in row.xpath('.//td')]
+            for row in tables[0].xpath('.//tr')[1:]  # Skip header row
+        )
         
-        for row in rows:
-            cols = row.find_all('td')
-            if len(cols) >= 4:
-                retailer = cols[0].get_text(strip=True)
-                machine_id = cols[1].get_text(strip=True)
-                address = cols[2].get_text(strip=True)
-                city_state = cols[3].get_text(strip=True)
-                
-                # Create full address
-                full_address = f"{address}, {city_state}"
-                
-                # Create JSON object for this location
-                location_data = {
-                    'name': retailer,
-                    'machine_id': machine_id,
-                    'address': full_address,
-                    'coordinates': {
-                        'lat': None,
-                        'lng': None
-                    }
-                }
-                
-                json_output.append(location_data)
-        
-        return json_output
+        # Create JSON object for each location
+        return [
+            {
+                'name': cells[0],
+                'machine_id': cells[1],
+                'address': cells[2] + ', ' + cells[3],
+                'lat': None,
+                'lng': None
+            }
+            for cells in rows
+            if len(cells) >= 4
+        ]
         
     except Exception as e:
         print(f"Error processing HTML: {e}")
         return None
 
+# Matches "Retailer | Q00000 | Address | City, ST" rows
+_PIPE_RE = re.compile(r'([A-Za-z\s&]+)\s*\|\s*(Q\d+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)')
+
 def parse_pipe_separated_data(text):
     """
     Fallback parser for pipe-separated data format
     """
-    # Extract data using regex pattern for the table format
-    pattern = r'([A-Za-z\s&]+)\s*\|\s*([Q]\d+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)'
-    matches = re.findall(pattern, text)
+    # Clean up the data
+    rows = (
+        tuple(group.strip() for group in match.groups())
+        for match in _PIPE_RE.finditer(text)
+    )
     
-    json_output = []
-    
-    for match in matches:
-        retailer, machine_id, address, city_state = match
-        
-        # Clean up the data
-        retailer = retailer.strip()
-        machine_id = machine_id.strip()
-        address = address.strip()
-        city_state = city_state.strip()
-        
-        # Skip header row or invalid data
-        if retailer.lower() in ['retailer', 'store'] or not machine_id.startswith('Q'):
-            continue
-        
-        # Create full address
-        full_address = f"{address}, {city_state}"
-        
-        # Create JSON object for this location
-        location_data = {
+    # Skip header row or invalid data
+    return [
+        {
             'name': retailer,
             'machine_id': machine_id,
-            'address': full_address,
-            'coordinates': {
-                'lat': None,
-                'lng': None
-            }
+            'address': address + ', ' + city_state,
+            'lat': None,
+            'lng': None
         }
-        
-        json_output.append(location_data)
-    
-    return json_output
+        for retailer, machine_id, address, city_state in rows
+        if retailer.lower() not in ('retailer', 'store') and machine_id.startswith('Q')
+    ]
 
 def save_to_file(data, filename='pokemon_vending_machines.json'):
     """
     Save the scraped data to a JSON file
     """
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filename, 'wb') as f:
+        f.write(_json_dumps_indented(data))
     print(f"Data saved to {filename}")
 
 def load_existing_data(filename='pokemon_vending_machines.json'):
@@ -108,8 +112,9 @@ def load_existing_data(filename='pokemon_vending_machines.json'):
     Load existing Pokemon vending machine data from JSON file
     """
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(filename, 'rb') as f:
+            content = f.read()
+        data = _json_loads(content)
         print(f"Loaded {len(data)} locations from {filename}")
         return data
     except FileNotFoundError:
@@ -119,10 +124,28 @@ def load_existing_data(filename='pokemon_vending_machines.json'):
         print(f"Error loading {filename}: {e}")
         return None
 
-def add_geocoding(data, api_key=None):
+class _RateLimiter:
+    """
+    Thread-safe limiter that hands out request slots at most queries_per_second apart
+    """
+    def __init__(self, queries_per_second):
+        self._interval = 1.0 / queries_per_second
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        time.sleep(slot - now)
+
+def add_geocoding(data, api_key=None, max_workers=10, queries_per_second=50):
     """
     Add geocoding using Google Maps API or other geocoding service
     Requires a Google Maps API key
+    
+    Requests are issued from a thread pool and spaced to stay under queries_per_second
     """
     if not api_key:
         print("No API key provided. Coordinates will remain null.")
@@ -130,26 +153,35 @@ def add_geocoding(data, api_key=None):
     
     try:
         import googlemaps
-        gmaps = googlemaps.Client(key=api_key)
+        gmaps = googlemaps.Client(key=api_key, queries_per_second=queries_per_second)
     except ImportError:
         print("googlemaps library not installed. Install with: pip install googlemaps")
         return data
     
+    # googlemaps' own queries_per_second check isn't thread-safe, so gate calls here
+    limiter = _RateLimiter(queries_per_second)
+    
+    def geocode(location):
+        limiter.wait()
+        return gmaps.geocode(location['address'])
+    
     print("Starting geocoding process...")
-    for i, location in enumerate(data):
-        try:
-            print(f"Geocoding {i+1}/{len(data)}: {location['address']}")
-            geocode_result = gmaps.geocode(location['address'])
-            if geocode_result:
-                lat = geocode_result[0]['geometry']['location']['lat']
-                lng = geocode_result[0]['geometry']['location']['lng']
-                location['coordinates']['lat'] = lat
-                location['coordinates']['lng'] = lng
-                print(f"  Success: {lat}, {lng}")
-            else:
-                print(f"  No results found for address")
-        except Exception as e:
-            print(f"  Geocoding failed: {e}")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(geocode, location): location for location in data}
+        
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Geocoding'):
+            location = futures[future]
+            try:
+                geocode_result = future.result()
+                if geocode_result:
+                    lat = geocode_result[0]['geometry']['location']['lat']
+                    lng = geocode_result[0]['geometry']['location']['lng']
+                    location['lat'] = lat
+                    location['lng'] = lng
+                else:
+                    tqdm.write(f"No results found for: {location.get('address')}")
+            except Exception as e:
+                tqdm.write(f"Geocoding failed for {location.get('address')}: {e}")
     
     return data
 
@@ -205,23 +237,21 @@ if __name__ == "__main__":
                 # Validate data
                 process_locations(data, 'validate')
             else:
-                # Just display summary
-                print(f"\nSummary:")
-                print(f"Total locations: {len(data)}")
-                
-                # Count by retailer
-                retailers = {}
+                # Just display summary; count retailers and coordinates in one pass
+                retailers = Counter()
+                with_coords = 0
                 for location in data:
-                    name = location.get('name', 'Unknown')
-                    retailers[name] = retailers.get(name, 0) + 1
+                    retailers[location.get('name', 'Unknown')] += 1
+                    if location.get('lat') is not None:
+                        with_coords += 1
                 
+                print(f"\nSummary:")
+                print(f"Total locations: {len(data)}")
                 print(f"Unique retailers: {len(retailers)}")
                 print("Top retailers:")
-                for retailer, count in sorted(retailers.items(), key=lambda x: x[1], reverse=True)[:10]:
+                for retailer, count in retailers.most_common(10):
                     print(f"  {retailer}: {count} locations")
                 
-                # Check how many have coordinates
-                with_coords = sum(1 for loc in data if loc.get('coordinates', {}).get('lat') is not None)
                 print(f"Locations with coordinates: {with_coords}/{len(data)}")
             
         else:
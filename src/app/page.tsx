@@ -17,15 +17,15 @@ const Map = dynamic(() => import('./components/Map'), {
 // Transform the JSON data to match our VendingMachine interface
 const transformVendingMachineData = (): VendingMachine[] => {
   return vendingMachinesData
-    .filter((machine): machine is typeof machine & { coordinates: { lat: number; lng: number } } => 
-      machine.coordinates.lat !== null && machine.coordinates.lng !== null
+    .filter((machine): machine is typeof machine & { lat: number; lng: number } => 
+      machine.lat !== null && machine.lng !== null
     )
     .map(machine => ({
       id: machine.machine_id,
       name: `${machine.name} - ${machine.address.split(',')[machine.address.split(',').length - 2]?.trim() || 'California'}`,
       address: machine.address,
-      lat: machine.coordinates.lat,
-      lng: machine.coordinates.lng,
+      lat: machine.lat,
+      lng: machine.lng,
       type: 'pokemon' as const
     }));
 };